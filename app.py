@@ -2,20 +2,44 @@ import streamlit as st
 import os
 from dotenv import load_dotenv
 import logging
-from processor import ExcelRAGProcessor
+from processor import ExcelRAGProcessor, find_data_files, open_workbooks, close_workbooks
+from query_cache import QueryCache
 import time
-import glob
 import requests
 import io
 import tempfile
+import html
 
 # Load environment variables
 load_dotenv()
 
+# Read once at import; reruns reuse the value instead of hitting the environment
+_GEMINI_KEY = os.getenv('GEMINI_API_KEY', '')
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Chat history is stored column-wise: one role byte and one content string per message
+USER_ROLE = ord('u')
+ASSISTANT_ROLE = ord('a')
+MAX_CHAT_MESSAGES = 200
+
+# Example questions shown to users; their answers are precomputed after each load
+EXAMPLE_QUERIES = [
+    ("📄", "What files do I have loaded?"),
+    ("👥", "Show me all agent names"),
+    ("📊", "Calculate average Total Premium"),
+    ("🔍", "Find agent with Sl number 5"),
+    ("👤", "Tell me about Mohammad Zahedul Islam"),
+    ("📈", "Compare commission data across files"),
+    ("💰", "What's the highest commission earned?"),
+    ("📋", "List all columns in my data"),
+]
+
+# Examples answered by processor.answer_metadata_query; test_processor.py checks they are routed there
+METADATA_EXAMPLES = ("What files do I have loaded?", "List all columns in my data")
+
 # App configuration
 st.set_page_config(
     page_title="📊 Smart Excel RAG Chatbot",
@@ -25,7 +49,10 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+@st.cache_data
+def get_custom_css():
+    """Return the app stylesheet, built once and reused on every rerun"""
+    return """
 <style>
 .main-header {
     background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -80,17 +107,30 @@ st.markdown("""
     height: 3em;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(get_custom_css(), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_shared_processor():
+    """Load the embedding model and open the caches once per server; this processor never holds data"""
+    processor = ExcelRAGProcessor()
+    processor.load_embeddings()
+    return processor
+
+def new_processor(gemini_key):
+    """Create a processor for one browser session, sharing the model and caches with all sessions"""
+    return ExcelRAGProcessor(gemini_key, share_with=get_shared_processor())
 
 def initialize_session_state():
     """Initialize session state variables"""
     if 'processor' not in st.session_state:
         # Try to get API key from environment variables first
-        gemini_key = os.getenv('GEMINI_API_KEY', '')
-        st.session_state.processor = ExcelRAGProcessor(gemini_key)
+        st.session_state.processor = new_processor(_GEMINI_KEY)
     
-    if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+    if 'chat_roles' not in st.session_state:
+        st.session_state.chat_roles = bytearray()
+        st.session_state.chat_contents = []
     
     if 'processing_status' not in st.session_state:
         st.session_state.processing_status = None
@@ -100,7 +140,7 @@ def display_header():
     st.markdown("""
     <div class="main-header">
         <h1>🎯 Smart Excel RAG Chatbot</h1>
-        <p>Powered by Google Gemini 2.0 Flash + LangChain RAG</p>
+        <p>Powered by Google Gemini 2.0 Flash + FAISS RAG</p>
         <span class="gemini-badge">🤖 Gemini 2.0 Flash</span>
     </div>
     """, unsafe_allow_html=True)
@@ -129,10 +169,7 @@ def download_google_drive_file(file_id, destination_path):
 
 def load_excel_files_from_folder():
     """Load Excel file paths from the current directory"""
-    excel_files = []
-    # Look for Excel files in the current directory
-    for ext in ['*.xlsx', '*.xls', '*.csv']:
-        excel_files.extend(glob.glob(ext))
+    excel_files = find_data_files('.')
     
     if not excel_files:
         st.error("❌ No Excel files found in the current directory!")
@@ -140,14 +177,38 @@ def load_excel_files_from_folder():
     
     return excel_files
 
+def process_files_with_progress(file_paths, status, use_parse_cache=True):
+    """Process files in parallel, reporting each file in the status container as it finishes"""
+    def report(result):
+        if result['status'] == 'success':
+            status.write(f"✅ {result['filename']} ({result['row_count']} rows)")
+        else:
+            status.write(f"❌ {result['filename']}")
+    
+    processor = st.session_state.processor
+    workbooks = open_workbooks(file_paths)
+    try:
+        results = processor.process_files(file_paths, workbooks, progress_callback=report,
+                                          use_parse_cache=use_parse_cache)
+    finally:
+        close_workbooks(workbooks)
+    
+    # Rows are indexed now; keep only the per-file summaries in session state
+    processor.release_parsed_data()
+    
+    try:
+        warm_query_cache(processor)
+    except Exception as e:
+        logger.error("Error warming query cache: %s", e)
+    return results
+
 def display_sidebar():
     """Display the sidebar with configuration options"""
     with st.sidebar:
         st.header("🔧 Configuration")
         
         # API Key configuration
-        gemini_key = os.getenv('GEMINI_API_KEY')
-        if gemini_key:
+        if _GEMINI_KEY:
             st.success("✅ Gemini API Key configured from .env")
         else:
             st.markdown("""
@@ -164,19 +225,19 @@ def display_sidebar():
             )
             
             if api_key_input:
-                st.session_state.processor = ExcelRAGProcessor(api_key_input)
+                st.session_state.processor.gemini_key = api_key_input
                 st.success("✅ API key configured!")
         
         st.divider()
         
         # Auto-load Excel files
         if st.button("📂 Load Excel Files from Folder", type="primary"):
-            with st.spinner("🔄 Loading Excel files from folder..."):
+            with st.status("🔄 Loading Excel files from folder...") as status:
                 try:
                     file_paths = load_excel_files_from_folder()
                     if file_paths:
                         start_time = time.time()
-                        results = st.session_state.processor.process_files(file_paths)
+                        results = process_files_with_progress(file_paths, status)
                         processing_time = time.time() - start_time
                         
                         st.session_state.results = results
@@ -193,7 +254,7 @@ def display_sidebar():
                             st.error("❌ No files were processed successfully")
                     
                 except Exception as e:
-                    logger.error(f"Error processing files: {e}")
+                    logger.error("Error processing files: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
                     st.error(f"❌ Processing Error: {str(e)}")
                     st.session_state.processing_status = {
                         'success': False,
@@ -233,7 +294,7 @@ def display_sidebar():
 
         if uploaded_files:
             if st.button("Process Uploaded Files", type="primary", key="process_uploaded"):
-                with st.spinner("🔄 Processing uploaded files..."):
+                with st.status("🔄 Processing uploaded files...") as status:
                     try:
                         # Save uploaded files temporarily
                         temp_files = []
@@ -243,9 +304,9 @@ def display_sidebar():
                                 f.write(uploaded_file.getvalue())
                             temp_files.append(temp_path)
                         
-                        # Process the files
+                        # Process the files; uploads are deleted afterwards, so their rows are not cached on disk
                         start_time = time.time()
-                        results = st.session_state.processor.process_files(temp_files)
+                        results = process_files_with_progress(temp_files, status, use_parse_cache=False)
                         processing_time = time.time() - start_time
                         
                         st.session_state.results = results
@@ -266,7 +327,7 @@ def display_sidebar():
                             st.error("❌ No files were processed successfully")
                         
                     except Exception as e:
-                        logger.error(f"Error processing files: {e}")
+                        logger.error("Error processing files: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
                         st.error(f"❌ Processing Error: {str(e)}")
                         st.session_state.processing_status = {
                             'success': False,
@@ -281,16 +342,100 @@ def display_sidebar():
         
         with col1:
             if st.button("🗑️ Clear All", help="Clear all data and reset"):
-                for key in list(st.session_state.keys()):
+                # Keep this session's processor, and the shared model, warm; drop everything else
+                keep = {'processor'}
+                for key in [k for k in st.session_state if k not in keep]:
                     del st.session_state[key]
+                st.session_state.processor.reset_store()
                 st.rerun()
         
         with col2:
             if st.button("💬 Reset Chat", help="Clear chat history"):
-                if 'chat_history' in st.session_state:
-                    st.session_state.chat_history = []
+                if 'chat_roles' in st.session_state:
+                    st.session_state.chat_roles = bytearray()
+                    st.session_state.chat_contents = []
                 st.success("Chat reset!")
 
+@st.cache_resource
+def get_query_cache():
+    """Open the cache of previous responses once; it is shared across reruns and sessions"""
+    return QueryCache()
+
+def query_cache_namespace(processor):
+    """Cache namespace for the loaded data and embedding model; models differ in vector size"""
+    processor.load_embeddings()
+    return f"{processor.data_signature()}:{processor.embedding_model}"
+
+def cached_query_stream(processor, user_input):
+    """Stream an answer, reusing cached answers for identical or near-identical questions"""
+    # Questions about the loaded files themselves are answered locally
+    metadata_answer = processor.answer_metadata_query(user_input)
+    if metadata_answer is not None:
+        yield metadata_answer
+        return
+    
+    query_cache = get_query_cache()
+    namespace = query_cache_namespace(processor)
+    response = query_cache.get(user_input, namespace)
+    if response is not None:
+        yield response
+        return
+    
+    embedding = processor.embed_query(user_input)
+    if embedding is not None:
+        response = query_cache.get_similar(user_input, namespace, embedding)
+        if response is not None:
+            yield response
+            return
+    
+    chunks = []
+    # The question embedding from the cache lookup is reused for the vector search
+    for chunk in processor.query_stream(user_input, embedding):
+        chunks.append(chunk)
+        yield chunk
+    query_cache.set(user_input, namespace, "".join(chunks), embedding)
+
+@st.cache_resource
+def embed_example_queries(embedding_model, _processor):
+    """Embed the example questions once per model; a failed embedding raises so it is not cached"""
+    embeddings = [_processor.embed_query(question) for _, question in EXAMPLE_QUERIES]
+    if any(embedding is None for embedding in embeddings):
+        raise ValueError(f"could not embed example questions with {embedding_model}")
+    return embeddings
+
+def get_example_embeddings(processor):
+    """Example question embeddings for the processor's model, or None for each if unavailable"""
+    if not processor.load_embeddings():
+        return [None] * len(EXAMPLE_QUERIES)
+    try:
+        return embed_example_queries(processor.embedding_model, processor)
+    except ValueError as e:
+        logger.warning("Example questions not embedded: %s", e)
+        return [None] * len(EXAMPLE_QUERIES)
+
+def warm_query_cache(processor):
+    """Pre-answer the example questions so the first clicks are served from the cache"""
+    query_cache = get_query_cache()
+    namespace = query_cache_namespace(processor)
+    embeddings = get_example_embeddings(processor)
+    for (_, question), embedding in zip(EXAMPLE_QUERIES, embeddings):
+        if query_cache.get(question, namespace) is None:
+            query_cache.set(question, namespace, processor.query(question, embedding), embedding)
+
+def append_chat_message(role, content):
+    """Append a message to the chat history, keeping only the most recent messages"""
+    st.session_state.chat_roles.append(role)
+    st.session_state.chat_contents.append(content)
+    if len(st.session_state.chat_contents) > MAX_CHAT_MESSAGES:
+        del st.session_state.chat_roles[:-MAX_CHAT_MESSAGES]
+        del st.session_state.chat_contents[:-MAX_CHAT_MESSAGES]
+
+def render_chat_message(role, content):
+    """Build the HTML for one chat message, escaping the message text"""
+    css_class, label = ("user-message", "You") if role == USER_ROLE else ("assistant-message", "Assistant")
+    body = html.escape(content).replace("\n", "<br>")
+    return f'<div class="chat-message {css_class}"><strong>{label}:</strong><br>{body}</div>'
+
 def display_chat_interface():
     """Display the main chat interface"""
     if not hasattr(st.session_state, 'results') or not st.session_state.results:
@@ -300,34 +445,40 @@ def display_chat_interface():
     # Chat input
     user_input = st.chat_input("Ask a question about your Excel data...")
     
+    # Offer the (pre-answered) example questions until the conversation starts
+    if not user_input and not st.session_state.chat_contents:
+        st.markdown("### 💡 Try an example:")
+        columns = st.columns(2)
+        for i, (icon, question) in enumerate(EXAMPLE_QUERIES):
+            if columns[i % 2].button(f"{icon} {question}", key=f"example_{i}"):
+                user_input = question
+    
+    # Display chat history as a single markdown element
+    chat_html = "".join(
+        render_chat_message(role, content)
+        for role, content in zip(st.session_state.chat_roles, st.session_state.chat_contents)
+    )
+    if chat_html:
+        st.markdown(chat_html, unsafe_allow_html=True)
+    
     if user_input:
         # Add user message to chat history
-        st.session_state.chat_history.append({"role": "user", "content": user_input})
+        append_chat_message(USER_ROLE, user_input)
+        st.markdown(render_chat_message(USER_ROLE, user_input), unsafe_allow_html=True)
         
-        # Get AI response
-        with st.spinner("🤔 Thinking..."):
-            try:
-                response = st.session_state.processor.query(user_input)
-                st.session_state.chat_history.append({"role": "assistant", "content": response})
-            except Exception as e:
-                logger.error(f"Error getting response: {e}")
-                error_msg = f"Sorry, I encountered an error: {str(e)}"
-                st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
-    
-    # Display chat history
-    for message in st.session_state.chat_history:
-        if message["role"] == "user":
-            st.markdown(f"""
-            <div class="chat-message user-message">
-                <strong>You:</strong><br>{message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div class="chat-message assistant-message">
-                <strong>Assistant:</strong><br>{message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
+        # Stream the response as it is produced, in the same bubble the history uses
+        placeholder = st.empty()
+        chunks = []
+        try:
+            for chunk in cached_query_stream(st.session_state.processor, user_input):
+                chunks.append(chunk)
+                placeholder.markdown(render_chat_message(ASSISTANT_ROLE, "".join(chunks)), unsafe_allow_html=True)
+            response = "".join(chunks)
+        except Exception as e:
+            logger.error("Error getting response: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
+            response = f"Sorry, I encountered an error: {str(e)}"
+            placeholder.markdown(render_chat_message(ASSISTANT_ROLE, response), unsafe_allow_html=True)
+        append_chat_message(ASSISTANT_ROLE, response)
 
 def display_welcome_screen():
     """Display the welcome screen with instructions"""
@@ -346,7 +497,7 @@ def display_welcome_screen():
     
     ### 🏗️ Technical Stack:
     - **AI Model:** Google Gemini 2.0 Flash (latest & fastest)
-    - **RAG System:** ChromaDB + HuggingFace Embeddings
+    - **RAG System:** FAISS + Sentence Transformers Embeddings
     - **Data Processing:** Pandas + Auto Header Detection
     - **UI Framework:** Streamlit
     
@@ -369,19 +520,8 @@ def display_welcome_screen():
     
     # Show example queries
     st.markdown("### 💡 Example Queries You Can Try:")
-    example_queries = [
-        "📄 What files do I have loaded?",
-        "👥 Show me all agent names",
-        "📊 Calculate average Total Premium",
-        "🔍 Find agent with Sl number 5",
-        "👤 Tell me about Mohammad Zahedul Islam",  
-        "📈 Compare commission data across files",
-        "💰 What's the highest commission earned?",
-        "📋 List all columns in my data"
-    ]
-    
-    for query in example_queries:
-        st.markdown(f"- {query}")
+    for icon, question in EXAMPLE_QUERIES:
+        st.markdown(f"- {icon} {question}")
 
 def main():
     """Main application function"""
@@ -0,0 +1,64 @@
+# embedding_cache.py - Persistent cache of record embeddings
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Keys per SELECT; stays under SQLite's bound-parameter limit
+_LOOKUP_BATCH = 500
+
+class EmbeddingCache:
+    """
+    Embeddings persisted in SQLite, keyed by a hash of the embedded text and the
+    model that produced them. Reloading unchanged files then needs no model calls.
+    """
+    
+    def __init__(self, path: str = ".ragcache/embeddings.db"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB, model TEXT, vector BLOB, PRIMARY KEY (key, model)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    def get_many(self, keys: List[bytes], model: str) -> Dict[bytes, np.ndarray]:
+        """Return the cached vectors found for the given keys."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? "
+                    f"AND key IN ({','.join('?' * len(batch))})",
+                    (model, *batch)
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+    
+    def set_many(self, items: Iterable[Tuple[bytes, np.ndarray]], model: str) -> None:
+        """Store vectors under their keys."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                ((key, model, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items)
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """Drop all cached embeddings."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+    
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
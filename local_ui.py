@@ -2,14 +2,24 @@ import os
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, filedialog, ttk
 from tkinter import font as tkFont
-from processor import ExcelRAGProcessor
+from processor import ExcelRAGProcessor, find_data_files, open_workbooks, close_workbooks
 import threading
+import queue
+import functools
 
 class ModernExcelChatApp:
     def __init__(self, root):
         self.root = root
         self.processor = ExcelRAGProcessor()
+        self._pending_messages = queue.Queue()
+        # Summary text for the currently loaded data, keyed by its content signature
+        self._summary = functools.lru_cache(maxsize=1)(self._build_summary)
+        # One long-lived worker runs file processing and queries in submission order
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self._run_jobs, daemon=True)
+        self.worker.start()
         self.setup_ui()
+        self.root.after(100, self._drain_messages)
         
     def setup_ui(self):
         """Setup the modern UI."""
@@ -196,12 +206,7 @@ class ModernExcelChatApp:
     
     def auto_load_files(self):
         """Automatically find and load Excel files from current directory."""
-        current_dir = os.getcwd()
-        excel_files = []
-        
-        for file_name in os.listdir(current_dir):
-            if file_name.lower().endswith(('.xlsx', '.xls', '.csv')):
-                excel_files.append(os.path.join(current_dir, file_name))
+        excel_files = find_data_files(os.getcwd())
         
         if excel_files:
             self.add_message("system", f"\n🔍 Auto-detected {len(excel_files)} Excel files in current directory:")
@@ -215,21 +220,62 @@ class ModernExcelChatApp:
             self.add_message("system", "🚀 Use the buttons above to load Excel files manually!")
     
     def add_message(self, sender, message):
-        """Add a message to the chat area."""
+        """Queue a message for the chat area (safe to call from worker threads)."""
         if sender == "system":
-            self.chat_area.insert(tk.END, f"🤖 System: {message}\n\n")
+            self._pending_messages.put(f"🤖 System: {message}\n\n")
         elif sender == "user":
-            self.chat_area.insert(tk.END, f"👤 You: {message}\n")
+            self._pending_messages.put(f"👤 You: {message}\n")
         elif sender == "bot":
-            self.chat_area.insert(tk.END, f"🤖 Assistant: {message}\n\n")
-        
-        self.chat_area.see(tk.END)
-        self.chat_area.update()
+            self._pending_messages.put(f"🤖 Assistant: {message}\n\n")
+    
+    def _take_pending_messages(self):
+        """Remove and return all queued message text."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._pending_messages.get_nowait())
+            except queue.Empty:
+                return "".join(batch)
+    
+    def _drain_messages(self):
+        """Flush queued messages to the chat area in a single insert, then reschedule."""
+        text = self._take_pending_messages()
+        if text:
+            self.chat_area.insert(tk.END, text)
+            self.chat_area.see(tk.END)
+        self.root.after(100, self._drain_messages)
+    
+    def _run_jobs(self):
+        """Worker loop: run queued (kind, payload, callback) jobs one at a time."""
+        handlers = {
+            'process': self._load_files,
+            'query': self._answer_question,
+            'clear': self._clear_data,
+            'summary': self._summarize_data,
+        }
+        while True:
+            kind, data, cb = self.jobs.get()
+            try:
+                result = handlers[kind](data)
+            except Exception as e:
+                result = e
+            finally:
+                self.jobs.task_done()
+            if cb is not None:
+                # Hand the result back to the Tk thread
+                self.root.after(0, cb, result)
+    
+    def _build_summary(self, data_sig):
+        """Build the data summary; called through the per-signature cache."""
+        return self.processor.get_all_data_summary()
+    
+    def data_summary(self):
+        """Return the data summary, rebuilding it only when the loaded data changes."""
+        return self._summary(self.processor.data_signature())
     
     def update_status(self, message):
-        """Update status bar."""
+        """Update status bar; Tk repaints it on the next idle cycle."""
         self.status_var.set(message)
-        self.root.update()
     
     def update_api_key(self):
         """Update the API key."""
@@ -249,10 +295,7 @@ class ModernExcelChatApp:
         if not directory:
             return
         
-        excel_files = []
-        for file_name in os.listdir(directory):
-            if file_name.lower().endswith(('.xlsx', '.xls', '.csv')):
-                excel_files.append(os.path.join(directory, file_name))
+        excel_files = find_data_files(directory)
         
         if not excel_files:
             messagebox.showwarning("Warning", "No Excel or CSV files found in the selected directory.")
@@ -275,77 +318,71 @@ class ModernExcelChatApp:
             self.process_files(list(files))
     
     def process_files(self, file_paths):
-        """Process selected files in a separate thread."""
-        def process_thread():
-            try:
-                self.update_status("🔄 Processing files...")
-                
-                if not hasattr(self, '_files_logged'):
-                    self.add_message("system", f"📁 Processing {len(file_paths)} files:")
-                    for file_path in file_paths:
-                        self.add_message("system", f"  • {os.path.basename(file_path)}")
-                    self._files_logged = True
-                
-                # Open files and process
-                uploaded_files = []
-                for file_path in file_paths:
-                    # Create a simple file-like object
-                    class FileWrapper:
-                        def __init__(self, path):
-                            self.name = os.path.basename(path)
-                            self.path = path
-                        
-                        def read(self):
-                            with open(self.path, 'rb') as f:
-                                return f.read()
-                    
-                    uploaded_files.append(FileWrapper(file_path))
-                
-                # Process files
-                self.add_message("system", "\n🔄 Processing with custom header detection...")
-                results = self.processor.process_files(uploaded_files)
-                
-                # Display results
-                self.add_message("system", "\n📊 Processing Results:")
-                success_count = 0
-                
-                for file_id, result in results.items():
-                    if result['status'] == 'success':
-                        success_count += 1
-                        self.add_message("system", 
-                            f"✅ {result['filename']}:\n"
-                            f"   • Header found at row: {result['header_row'] + 1}\n"
-                            f"   • Rows deleted above header: {result['rows_deleted_above_header']}\n"
-                            f"   • Data rows: {result['row_count']}\n"
-                            f"   • Columns: {result['column_count']}\n"
-                            f"   • Sample columns: {', '.join(result['columns'][:3])}...\n"
-                        )
-                    else:
-                        self.add_message("system", f"❌ {result['filename']}: {result.get('error', 'Unknown error')}")
-                
-                if success_count > 0:
-                    self.add_message("system", f"\n🎉 Successfully processed {success_count}/{len(results)} files!")
-                    self.add_message("system", "💬 You can now start asking questions about your data!")
-                    self.add_message("system", "\n💡 Try asking: 'What files do I have?' or 'Show me data for ID 157408'")
-                    
-                    # Add data summary for debugging
-                    summary = self.processor.get_all_data_summary()
-                    self.add_message("system", f"\n📋 Data loaded successfully! Use 'show all data' to see complete summary.")
-                    
-                    self.update_status(f"✅ Ready - {success_count} files loaded")
-                else:
-                    self.add_message("system", "❌ No files were processed successfully.")
-                    self.update_status("❌ Processing failed")
-                
-            except Exception as e:
-                error_msg = f"Processing error: {str(e)}"
-                self.add_message("system", f"❌ {error_msg}")
-                self.update_status("❌ Error occurred")
-        
-        # Run processing in separate thread to avoid UI freezing
-        thread = threading.Thread(target=process_thread)
-        thread.daemon = True
-        thread.start()
+        """Queue the selected files for processing on the worker thread."""
+        self.update_status("🔄 Processing files...")
+        
+        if not hasattr(self, '_files_logged'):
+            self.add_message("system", f"📁 Processing {len(file_paths)} files:")
+            for file_path in file_paths:
+                self.add_message("system", f"  • {os.path.basename(file_path)}")
+            self._files_logged = True
+        
+        self.jobs.put(('process', file_paths, self._on_files_processed))
+    
+    def _load_files(self, file_paths):
+        """Parse and index files (runs on the worker thread)."""
+        # Open each workbook once and process from the open handles
+        workbooks = open_workbooks(file_paths)
+        try:
+            self.add_message("system", "\n🔄 Processing with custom header detection...")
+            results = self.processor.process_files(
+                file_paths, workbooks,
+                progress_callback=lambda r: self.add_message("system", f"  ⏳ Parsed {r['filename']}")
+            )
+        finally:
+            close_workbooks(workbooks)
+        self.processor.release_parsed_data()
+        
+        if any(result['status'] == 'success' for result in results.values()):
+            # Build the data summary now so 'show all data' answers from cache
+            self.data_summary()
+        return results
+    
+    def _on_files_processed(self, results):
+        """Report processing results (runs on the Tk thread)."""
+        if isinstance(results, Exception):
+            error_msg = f"Processing error: {str(results)}"
+            self.add_message("system", f"❌ {error_msg}")
+            self.update_status("❌ Error occurred")
+            return
+        
+        # Display results
+        self.add_message("system", "\n📊 Processing Results:")
+        success_count = 0
+        
+        for file_id, result in results.items():
+            if result['status'] == 'success':
+                success_count += 1
+                self.add_message("system", 
+                    f"✅ {result['filename']}:\n"
+                    f"   • Header found at row: {result['header_row'] + 1}\n"
+                    f"   • Rows deleted above header: {result['rows_deleted_above_header']}\n"
+                    f"   • Data rows: {result['row_count']}\n"
+                    f"   • Columns: {result['column_count']}\n"
+                    f"   • Sample columns: {', '.join(result['columns'][:3])}...\n"
+                )
+            else:
+                self.add_message("system", f"❌ {result['filename']}: {result.get('error', 'Unknown error')}")
+        
+        if success_count > 0:
+            self.add_message("system", f"\n🎉 Successfully processed {success_count}/{len(results)} files!")
+            self.add_message("system", "💬 You can now start asking questions about your data!")
+            self.add_message("system", "\n💡 Try asking: 'What files do I have?' or 'Show me data for ID 157408'")
+            self.add_message("system", f"\n📋 Data loaded successfully! Use 'show all data' to see complete summary.")
+            self.update_status(f"✅ Ready - {success_count} files loaded")
+        else:
+            self.add_message("system", "❌ No files were processed successfully.")
+            self.update_status("❌ Processing failed")
     
     def ask_question(self):
         """Process user question."""
@@ -356,9 +393,17 @@ class ModernExcelChatApp:
         
         # Handle special commands
         if question.lower() in ['show all data', 'show data summary', 'debug data']:
-            summary = self.processor.get_all_data_summary()
+            # Read on the worker, after any load still in progress
             self.add_message("user", question)
-            self.add_message("bot", summary)
+            self.input_box.delete(0, tk.END)
+            self.jobs.put(('summary', None, self._on_summary))
+            return
+        
+        # Questions about the loaded files are answered locally, without a query round-trip
+        metadata_answer = self.processor.answer_metadata_query(question)
+        if metadata_answer is not None:
+            self.add_message("user", question)
+            self.add_message("bot", metadata_answer)
             self.input_box.delete(0, tk.END)
             return
         
@@ -369,34 +414,57 @@ class ModernExcelChatApp:
             self.add_message("bot", "No data loaded. Please process Excel files first.")
             return
         
-        def query_thread():
-            try:
-                self.update_status("🤔 AI is thinking...")
-                self.ask_button.config(state='disabled', text='🤔 Thinking...')
-                
-                answer = self.processor.query(question)
-                self.add_message("bot", answer)
-                
-                self.update_status("✅ Response generated")
-                self.ask_button.config(state='normal', text='🚀 Ask')
-                
-            except Exception as e:
-                self.add_message("bot", f"Sorry, I encountered an error: {str(e)}")
-                self.update_status("❌ Error in response")
-                self.ask_button.config(state='normal', text='🚀 Ask')
-        
-        # Run query in separate thread
-        thread = threading.Thread(target=query_thread)
-        thread.daemon = True
-        thread.start()
+        self.update_status("🤔 AI is thinking...")
+        self.ask_button.config(state='disabled', text='🤔 Thinking...')
+        self.jobs.put(('query', question, self._on_answer))
+    
+    def _answer_question(self, question):
+        """Run a query against the processor (runs on the worker thread)."""
+        return self.processor.query(question)
+    
+    def _summarize_data(self, _):
+        """Build or reuse the data summary (runs on the worker thread)."""
+        return self.data_summary()
+    
+    def _on_summary(self, summary):
+        """Show the data summary (runs on the Tk thread)."""
+        if isinstance(summary, Exception):
+            self.add_message("bot", f"Sorry, I encountered an error: {str(summary)}")
+        else:
+            self.add_message("bot", summary)
+    
+    def _on_answer(self, answer):
+        """Show a query answer (runs on the Tk thread)."""
+        if isinstance(answer, Exception):
+            self.add_message("bot", f"Sorry, I encountered an error: {str(answer)}")
+            self.update_status("❌ Error in response")
+        else:
+            self.add_message("bot", answer)
+            self.update_status("✅ Response generated")
+        self.ask_button.config(state='normal', text='🚀 Ask')
     
     def clear_all(self):
         """Clear all data and reset."""
         if messagebox.askyesno("Confirm", "Are you sure you want to clear all data?"):
-            self.processor = ExcelRAGProcessor(self.processor.gemini_key)
-            self.chat_area.delete(1.0, tk.END)
-            self.add_message("system", "🔄 All data cleared. Ready for new files!")
-            self.update_status("Ready - Load Excel files to start chatting!")
+            # Queued behind any running load or query, so none of them sees the data vanish
+            self.update_status("🔄 Clearing data...")
+            self.jobs.put(('clear', None, self._on_cleared))
+    
+    def _clear_data(self, _):
+        """Drop the loaded data, keeping the embedding model (runs on the worker thread)."""
+        self.processor.reset_store()
+        self._summary.cache_clear()
+    
+    def _on_cleared(self, error):
+        """Reset the chat once the data is cleared (runs on the Tk thread)."""
+        if isinstance(error, Exception):
+            self.add_message("system", f"❌ Error clearing data: {str(error)}")
+            self.update_status("❌ Error occurred")
+            return
+        self._take_pending_messages()
+        self.chat_area.delete(1.0, tk.END)
+        self.add_message("system", "🔄 All data cleared. Ready for new files!")
+        self.update_status("Ready - Load Excel files to start chatting!")
 
 def main():
     """Run the application."""
@@ -1,26 +1,219 @@
 # processor.py - UPDATED VERSION
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple
 import logging
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.docstore.document import Document
+import faiss
+from python_calamine import CalamineWorkbook, SheetTypeEnum
+from sentence_transformers import SentenceTransformer
+try:
+    from model2vec import StaticModel
+except ImportError:  # Optional: fall back to the transformer model
+    StaticModel = None
 import requests
+import gc
+import shelve
+import threading
 import json
+import hashlib
 import os
 import re
+import heapq
+import functools
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# File types the processor can load
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+# Optional scope at the end of a metadata question, e.g. "... in my data"
+_METADATA_SCOPE = r"(?: in (?:my|the|all)(?: loaded)? (?:data|files))?"
+
+# Questions about the loaded data itself, answered without retrieval; matched against
+# the whole question so questions that filter the data are not caught
+METADATA_QUERY_RE = re.compile(
+    r"(?:(?P<files>(?:(?:what|which) files(?: do i have| are)?(?: loaded)?"
+    r"|(?:list|show)(?: me)?(?: the| all)?(?: loaded)? files)" + _METADATA_SCOPE + ")"
+    r"|(?P<columns>(?:(?:list|show)(?: me)?(?: the| all)? (?:columns|column names)"
+    r"|(?:what|which)(?: are the)? (?:columns|column names)(?: are there| do i have| are)?"
+    r"|column names)" + _METADATA_SCOPE + ")"
+    r"|(?P<rows>how many (?:rows|records)(?: are| do i have)?(?: there| loaded)?(?: in total)?"
+    + _METADATA_SCOPE + "))"
+    r"\s*\??",
+    re.IGNORECASE
+)
+
+# 4-6 digit IDs mentioned in a question
+QUERY_ID_RE = re.compile(r'\b(\d{4,6})\b')
+
+# Question phrases mapped to the columns that may hold the requested field, in priority order
+FIELD_MAPPINGS = {
+    'ac no': ['Ac No', 'Account No', 'Account Number'],
+    'organization': ['Organization', 'Org', 'Company'],
+    'designation': ['Designation', 'Position', 'Title'],
+    'job duration': ['Job Duration', 'Duration', 'Service'],
+    'total business': ['Total Business', 'Total Premium', 'Business'],
+    'commission': ['Commission', 'Com'],
+    'pf': ['PF', 'Provident Fund'],
+    'allowance': ['Allowance', 'Allow'],
+    'net pay': ['Net Pay', 'Net', 'Pay'],
+    'tds': ['TDS', 'Tax'],
+    'total premium': ['Total Premium', 'Premium', 'Total PR'],
+    'agent name': ['Agent Name', 'Name'],
+    'sl': ['Sl', 'Serial', 'ID']
+}
+
+# Finds every field phrase in a question in one pass; the lookahead lets matches overlap
+FIELD_PHRASE_RE = re.compile('(?=(' + '|'.join(map(re.escape, FIELD_MAPPINGS)) + '))')
+
+@functools.lru_cache(maxsize=128)
+def _name_pattern(search_id: str) -> re.Pattern:
+    """Pattern capturing the name written after an ID and a dash."""
+    return re.compile(rf'{re.escape(search_id)}\s*-\s*([^?]+)')
+
+# Word tokens used by the fallback text search
+TOKEN_RE = re.compile(r'\w+')
+
+# Cell values indexed for O(1) ID lookups; matches the IDs the query layer extracts.
+# Only columns holding nothing but IDs are indexed whole, so amounts are never taken for IDs
+ID_VALUE_RE = r'\d{4,6}'
+# Leading ID of an "ID - Name" cell such as "102016 - Ruaida Jannat"
+ID_NAME_RE = r'^(\d{4,6})\s*-\s*[^\W\d_]'
+
+# Rows examined first when looking for the header row
+HEADER_PROBE_ROWS = 50
+
+# Rows read per chunk when streaming CSV files
+CSV_CHUNK_ROWS = 50_000
+
+# Text cells pandas.read_excel treats as missing; sheets read directly with
+# calamine keep the same cell values
+SHEET_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+])
+
+# Upper bound on workbooks parsed concurrently
+MAX_PARSE_WORKERS = 8
+
+# Parsed workbook results kept across runs; bump the version when parsing output changes
+PARSE_CACHE_PATH = ".ragcache/parse_cache"
+PARSE_CACHE_VERSION = 2
+
+# Static (lookup + mean pool) embedding model, used when model2vec is installed
+STATIC_EMBEDDING_MODEL = "minishlab/potion-base-8M"
+
+# Sentence embedding model and the texts it encodes per forward pass
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+# Texts encoded per step; each step's vectors are cached while the next step encodes
+EMBED_WRITE_BATCH = 256
+
+# Records returned by a vector search
+VECTOR_SEARCH_K = 3
+
+def find_data_files(directory: str = '.') -> List[str]:
+    """Return the paths of supported Excel/CSV files in a directory (single scandir pass)."""
+    with os.scandir(directory) as entries:
+        return [
+            entry.path for entry in entries
+            if entry.is_file() and entry.name.lower().endswith(SUPPORTED_EXTENSIONS)
+        ]
+
+def open_workbooks(file_paths: List[str]) -> Dict[str, CalamineWorkbook]:
+    """
+    Open each Excel workbook once so it can be parsed from the open handle.
+    CSV files and workbooks that fail to open are left out and read from their path.
+    """
+    workbooks = {}
+    for file_path in file_paths:
+        if file_path.lower().endswith('.csv'):
+            continue
+        try:
+            workbooks[file_path] = CalamineWorkbook.from_path(file_path)
+        except Exception as e:
+            logger.warning("Could not open workbook %s: %s", file_path, e)
+    return workbooks
+
+def close_workbooks(workbooks: Dict[str, CalamineWorkbook]) -> None:
+    """Close workbook handles returned by open_workbooks."""
+    for workbook in workbooks.values():
+        workbook.close()
+
+def _sheet_cell(value: Any) -> Any:
+    """Convert a calamine cell value the way pandas.read_excel does."""
+    if isinstance(value, str):
+        return np.nan if value in SHEET_NA_VALUES else value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+def read_first_sheet(workbook: CalamineWorkbook) -> pd.DataFrame:
+    """
+    Raw cells of a workbook's first worksheet, without a header row.
+    Rows come straight from calamine and are converted once, instead of going
+    through pandas' ExcelFile and text parser.
+    """
+    sheet_name = next(
+        (sheet.name for sheet in workbook.sheets_metadata if sheet.typ == SheetTypeEnum.WorkSheet), None
+    )
+    if sheet_name is None:
+        raise ValueError("Workbook has no worksheets")
+    rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+    return pd.DataFrame([[_sheet_cell(cell) for cell in row] for row in rows], dtype=object)
+
 class ExcelRAGProcessor:
     """Enhanced processor for Excel files with systematic data search."""
     
-    def __init__(self, gemini_key: str = None):
+    def __init__(self, gemini_key: str = None, share_with: Optional['ExcelRAGProcessor'] = None):
+        """
+        share_with, if given, is a processor whose embedding model and caches are
+        reused instead of loading and opening new ones; loaded data is never shared.
+        """
         self.processed_files = {}
+        self._chunk_sources = {}  # Per-source header state for index_chunk
+        self._data_signature = None
+        self.records_df = None  # all_records as a DataFrame, built on the first ID lookup
+        self._records_str = None  # Per-record joined values, for substring lookups
+        self._records_lower = None
+        self._id_index = None  # ID-like cell value -> positions in all_records
+        self._inverted = None  # Token -> (position, fields containing it) for text search
+        self._indexed_rows = set()  # Content hashes of rows already in the vector store
         self.all_records = []  # Centralized data storage
+        self._doc_texts = []  # Serialized text of each record, aligned with all_records
         self.embeddings = None  # Initialize as None
-        self.vector_store = None
+        self.embedding_model = None  # Name of the model behind self.embeddings
+        self.vector_store = None  # FAISS inner-product index over the record embeddings
+        self._documents = []  # Record texts, in vector_store order
+        self._owns_caches = share_with is None  # Only the owner closes the caches
+        self._parsed_paths = set()  # Parse cache keys of the files this processor loaded
+        if share_with is not None:
+            self.embeddings = share_with.embeddings
+            self.embedding_model = share_with.embedding_model
+            self._embedding_cache = share_with._embedding_cache
+            self._parse_cache = share_with._parse_cache
+            self._parse_cache_lock = share_with._parse_cache_lock
+        else:
+            self._embedding_cache = None
+            try:
+                # Vectors of previously embedded record texts, reused across loads and runs
+                self._embedding_cache = EmbeddingCache()
+            except Exception as e:
+                logger.warning("Embedding cache unavailable: %s", e)
+            self._parse_cache = None
+            self._parse_cache_lock = threading.Lock()  # shelve is not safe across parse threads
+            try:
+                os.makedirs(os.path.dirname(PARSE_CACHE_PATH), exist_ok=True)
+                self._parse_cache = shelve.open(PARSE_CACHE_PATH)
+            except Exception as e:
+                logger.warning("Parse cache unavailable: %s", e)
         self.conversation_history = []
         self.gemini_key = gemini_key or os.getenv('GEMINI_API_KEY')
         
@@ -29,137 +222,337 @@ class ExcelRAGProcessor:
     
     def _initialize_embeddings(self):
         """Lazy initialization of embeddings to avoid startup errors."""
+        if self.embeddings is None and StaticModel is not None:
+            try:
+                # Token lookups instead of transformer inference; records are short key: value text
+                self.embeddings = StaticModel.from_pretrained(STATIC_EMBEDDING_MODEL)
+                self.embedding_model = STATIC_EMBEDDING_MODEL
+                logger.info("Static embeddings initialized successfully")
+            except Exception as e:
+                logger.warning("Failed to load static embeddings, using %s: %s", EMBEDDING_MODEL, e)
         if self.embeddings is None:
             try:
-                self.embeddings = HuggingFaceEmbeddings(
-                    model_name="sentence-transformers/all-MiniLM-L6-v2",
-                    model_kwargs={'device': 'cpu'},
-                    encode_kwargs={'normalize_embeddings': True}
-                )
+                self.embeddings = SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+                self.embedding_model = EMBEDDING_MODEL
                 logger.info("Embeddings initialized successfully")
             except Exception as e:
-                logger.error(f"Failed to initialize embeddings: {e}")
+                logger.error("Failed to initialize embeddings: %s", e)
                 # Fallback: create a simple text-based search
                 self.embeddings = None
+                self.embedding_model = None
+    
+    def load_embeddings(self) -> bool:
+        """Load the embedding model now rather than on first use; True if it is available."""
+        self._initialize_embeddings()
+        return self.embeddings is not None
     
-    def find_header_with_sequential_pattern(self, data: List[List]) -> Optional[int]:
+    def find_header_with_sequential_pattern(self, df: pd.DataFrame) -> Optional[int]:
         """
         Find header by detecting 3 sequential rows with both null and non-null values.
         The first row among these 3 rows will be considered the header.
         """
-        for i in range(len(data) - 2):
-            row1 = data[i] if i < len(data) else []
-            row2 = data[i + 1] if i + 1 < len(data) else []
-            row3 = data[i + 2] if i + 2 < len(data) else []
-            
-            # Check if all three rows have both null and non-null values
-            if (self._has_mixed_values(row1) and 
-                self._has_mixed_values(row2) and 
-                self._has_mixed_values(row3)):
-                
-                logger.info(f"Found header pattern at rows {i}, {i+1}, {i+2}")
-                return i  # Return the first row of the pattern as header
+        # Probe the top of the sheet first; only scan the remaining rows if needed
+        null = self._null_mask(df.iloc[:HEADER_PROBE_ROWS])
+        header_row = self._first_mixed_run(null)
+        if header_row is None and len(df) > HEADER_PROBE_ROWS:
+            null = np.vstack([null, self._null_mask(df.iloc[HEADER_PROBE_ROWS:])])
+            header_row = self._first_mixed_run(null)
+        
+        if header_row is not None:
+            logger.info("Found header pattern at rows %s, %s, %s", header_row, header_row+1, header_row+2)
+            return header_row  # Return the first row of the pattern as header
         
         # Fallback: look for first row with mostly non-null values
-        for i, row in enumerate(data[:10]):  # Check first 10 rows
-            non_null_count = sum(1 for cell in row if cell is not None and str(cell).strip())
-            if non_null_count >= len(row) * 0.5:  # At least 50% non-null
-                logger.info(f"Using fallback header detection at row {i}")
-                return i
+        top = df.iloc[:10].to_numpy(dtype=object)  # Check first 10 rows
+        if top.size:
+            non_null = np.not_equal(top, None) & (np.char.strip(top.astype(str)) != '')
+            mostly_filled = non_null.sum(axis=1) >= top.shape[1] * 0.5  # At least 50% non-null
+            if mostly_filled.any():
+                header_row = int(np.argmax(mostly_filled))
+                logger.info("Using fallback header detection at row %s", header_row)
+                return header_row
         
         return None
     
-    def _has_mixed_values(self, row: List) -> bool:
-        """Check if a row has both null and non-null values."""
-        if not row:
-            return False
-        
-        has_null = False
-        has_non_null = False
-        
-        for cell in row:
-            if cell is None or str(cell).strip() == '' or str(cell).lower() in ['nan', 'none']:
-                has_null = True
-            else:
-                has_non_null = True
-            
-            # Early return if we found both
-            if has_null and has_non_null:
-                return True
-        
-        return has_null and has_non_null
+    @staticmethod
+    def _null_mask(df: pd.DataFrame) -> np.ndarray:
+        """Boolean mask of cells that are empty, None/NaN or the text 'nan'/'none'."""
+        null = df.isna().to_numpy(copy=True)
+        # Only text columns can hold blank or 'nan'/'none' strings
+        for col_idx, (_, column) in enumerate(df.items()):
+            if column.dtype == object or isinstance(column.dtype, pd.StringDtype):
+                text = column.astype(str)
+                null[:, col_idx] |= ((text.str.strip() == '')
+                                     | text.str.lower().isin(('nan', 'none'))).to_numpy()
+        return null
+    
+    @staticmethod
+    def _first_mixed_run(null: np.ndarray) -> Optional[int]:
+        """Index of the first of 3 consecutive rows that each mix null and non-null cells."""
+        if null.shape[0] < 3 or null.shape[1] == 0:
+            return None
+        mixed = null.any(axis=1) & ~null.all(axis=1)
+        run = mixed[:-2] & mixed[1:-1] & mixed[2:]
+        return int(np.argmax(run)) if run.any() else None
     
-    def process_files(self, file_paths: List[str]) -> Dict[str, Any]:
-        """Process multiple Excel files with systematic data storage."""
+    def process_files(self, file_paths: List[str],
+                      workbooks: Optional[Dict[str, CalamineWorkbook]] = None,
+                      progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      use_parse_cache: bool = True) -> Dict[str, Any]:
+        """
+        Process multiple Excel files with systematic data storage.
+        Workbooks already opened with open_workbooks() are parsed from their handle,
+        several at a time; CSV files are streamed in chunks through index_chunk().
+        progress_callback, if given, is called with each file's result as it finishes.
+        use_parse_cache=False keeps the parsed rows out of the on-disk parse cache,
+        for files such as uploads that are deleted after loading.
+        """
+        workbooks = workbooks or {}
+        if use_parse_cache:
+            self._prune_parse_cache()
         results = {}
+        excel_files = []
+        csv_files = []
         self.all_records = []  # Reset centralized storage
+        self._doc_texts = []
+        self._chunk_sources = {}
+        self._data_changed()
         
         for i, file_path in enumerate(file_paths):
-            try:
-                file_id = f"file_{i+1}"
-                # Pass the file path to the internal processing method
-                result = self._process_single_file(file_path, file_id)
-                results[file_id] = result
-                
-                # Add all records to centralized storage
-                if result['status'] == 'success':
-                    self.all_records.extend(result['data'])
-                
-                logger.info(f"Processed {file_path}")
-            except Exception as e:
-                logger.error(f"Error processing {file_path}: {e}")
-                results[f"file_{i+1}"] = {
-                    'status': 'error',
-                    'filename': os.path.basename(file_path),
-                    'error': str(e)
+            file_id = f"file_{i+1}"
+            if file_path.lower().endswith('.csv'):
+                csv_files.append((file_id, file_path))
+            else:
+                excel_files.append((file_id, file_path))
+        
+        if excel_files:
+            with ThreadPoolExecutor(max_workers=min(MAX_PARSE_WORKERS, len(excel_files))) as executor:
+                futures = {
+                    executor.submit(self.process_one, file_path, file_id,
+                                    workbooks.get(file_path), use_parse_cache): file_id
+                    for file_id, file_path in excel_files
                 }
+                for future in as_completed(futures):
+                    result = results[futures[future]] = future.result()
+                    if progress_callback:
+                        progress_callback(result)
+        
+        # Add records to centralized storage in input order, not completion order
+        for file_id, _ in excel_files:
+            if results[file_id]['status'] == 'success':
+                self.all_records.extend(results[file_id]['data'])
+        # Anything derived while the files were parsing describes the partial data
+        self._data_changed()
         
         self.processed_files = results
         self._build_rag_system()
         
-        logger.info(f"Total records loaded: {len(self.all_records)}")
-        return results
+        # CSVs are indexed incrementally so only one chunk is held in memory at a time
+        for file_id, file_path in csv_files:
+            try:
+                for chunk in pd.read_csv(file_path, header=None, dtype=str, chunksize=CSV_CHUNK_ROWS):
+                    self.index_chunk(chunk, source=file_path, file_id=file_id)
+                if file_id not in results:
+                    raise ValueError(f"No data found in {os.path.basename(file_path)}")
+                logger.info("Processed %s", file_path)
+            except Exception as e:
+                logger.error("Error processing %s: %s", file_path, e)
+                results[file_id] = self._error_result(file_path, e)
+            if progress_callback:
+                progress_callback(results[file_id])
+        
+        # Keep results in the order the files were given
+        self.processed_files = {f"file_{i+1}": results[f"file_{i+1}"] for i in range(len(file_paths))}
+        
+        logger.info("Total records loaded: %s", len(self.all_records))
+        return self.processed_files
+    
+    def index_chunk(self, chunk: pd.DataFrame, source: str, file_id: str = None) -> Dict[str, Any]:
+        """
+        Incrementally add a chunk of raw rows (read with header=None) from a source.
+        The header is detected on the first chunk of each source and reused for the
+        following ones. Records are appended to the loaded data and the vector store.
+        """
+        state = self._chunk_sources.get(source)
+        
+        if state is None:
+            header_row = self.find_header_with_sequential_pattern(chunk)
+            if header_row is None:
+                raise ValueError(f"Could not detect header row in {os.path.basename(source)}")
+            
+            file_id = file_id or f"file_{len(self.processed_files)+1}"
+            headers = self._extract_headers(chunk.iloc[header_row].tolist())
+            result = self._success_result(source, file_id, [], headers, header_row)
+            self.processed_files[file_id] = result
+            state = self._chunk_sources[source] = {'result': result, 'next_row_index': 0}
+            chunk = chunk.iloc[header_row + 1:]
+        
+        result = state['result']
+        records = self._build_records(
+            chunk, result['columns'], result['file_id'], result['filename'],
+            result['header_row'], state['next_row_index']
+        )
+        state['next_row_index'] += len(chunk)
+        
+        result['data'].extend(records)
+        result['row_count'] += len(records)
+        self.all_records.extend(records)
+        self._data_changed()
+        self._add_documents(records)
+        return result
+    
+    def process_one(self, file_path: str, file_id: str,
+                    workbook: Optional[CalamineWorkbook] = None,
+                    use_parse_cache: bool = True) -> Dict[str, Any]:
+        """Process a single file, returning an error result instead of raising."""
+        try:
+            result = self._cached_parse(file_path, file_id) if use_parse_cache else None
+            if result is None:
+                result = self._process_single_file(file_path, file_id, workbook)
+                if use_parse_cache:
+                    self._store_parse(file_path, result)
+                logger.info("Processed %s", file_path)
+            return result
+        except Exception as e:
+            logger.error("Error processing %s: %s", file_path, e)
+            return self._error_result(file_path, e)
+    
+    @staticmethod
+    def _parse_cache_entry(file_path: str) -> Tuple[str, Tuple[int, int, int]]:
+        """Cache key for a file and the stamp that tells whether its cached result is current."""
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), (PARSE_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
     
-    def _process_single_file(self, file_path: str, file_id: str) -> Dict[str, Any]:
+    def _cached_parse(self, file_path: str, file_id: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result for an unchanged file, re-stamped with file_id, or None."""
+        if self._parse_cache is None:
+            return None
+        try:
+            key, stamp = self._parse_cache_entry(file_path)
+            with self._parse_cache_lock:
+                entry = self._parse_cache.get(key)
+                self._parsed_paths.add(key)
+        except Exception as e:
+            logger.warning("Error reading parse cache for %s: %s", file_path, e)
+            return None
+        if entry is None or entry[0] != stamp:
+            return None
+        
+        # File ids follow the order of the current load, not the one the result was cached from
+        result = entry[1]
+        result['file_id'] = file_id
+        for record in result['data']:
+            record['_file_id'] = file_id
+        logger.info("Loaded %s from parse cache", file_path)
+        return result
+    
+    def _store_parse(self, file_path: str, result: Dict[str, Any]):
+        """Cache a successfully parsed result under the file's current stamp."""
+        if self._parse_cache is None:
+            return
+        try:
+            key, stamp = self._parse_cache_entry(file_path)
+            with self._parse_cache_lock:
+                self._parse_cache[key] = (stamp, result)
+                self._parse_cache.sync()
+                self._parsed_paths.add(key)
+        except Exception as e:
+            logger.warning("Error writing parse cache for %s: %s", file_path, e)
+    
+    def _prune_parse_cache(self):
+        """
+        Drop cached results of files that no longer exist. Results of files that
+        changed are replaced under the same key when the file is next loaded.
+        """
+        if self._parse_cache is None:
+            return
+        try:
+            with self._parse_cache_lock:
+                missing = [key for key in self._parse_cache.keys() if not os.path.exists(key)]
+                for key in missing:
+                    del self._parse_cache[key]
+                if missing:
+                    self._parse_cache.sync()
+                    logger.info("Dropped %s parse cache entries for missing files", len(missing))
+        except Exception as e:
+            logger.warning("Error pruning parse cache: %s", e)
+    
+    def _forget_parses(self):
+        """Drop the cached results of the files this processor loaded."""
+        if self._parse_cache is not None and self._parsed_paths:
+            try:
+                with self._parse_cache_lock:
+                    for key in self._parsed_paths:
+                        self._parse_cache.pop(key, None)
+                    self._parse_cache.sync()
+            except Exception as e:
+                logger.warning("Error clearing parse cache: %s", e)
+        self._parsed_paths = set()
+    
+    def _process_single_file(self, file_path: str, file_id: str,
+                             workbook: Optional[CalamineWorkbook] = None) -> Dict[str, Any]:
         """Process a single Excel file with enhanced header detection."""
         filename = os.path.basename(file_path)
         
         try:
-            # Open and read the file using pandas
-            if file_path.lower().endswith('.csv'):
+            # Excel cells are kept as read (object dtype); they are turned into strings afterwards anyway
+            if workbook is not None:
+                df_raw = read_first_sheet(workbook)
+            elif file_path.lower().endswith('.csv'):
                 df_raw = pd.read_csv(file_path, header=None)
             else:
-                df_raw = pd.read_excel(file_path, header=None, engine='openpyxl')
+                # calamine reports a missing file as a plain OSError
+                if not os.path.isfile(file_path):
+                    raise FileNotFoundError(file_path)
+                with CalamineWorkbook.from_path(file_path) as opened:
+                    df_raw = read_first_sheet(opened)
         except FileNotFoundError:
             raise FileNotFoundError(f"File not found: {file_path}")
         except Exception as e:
             raise IOError(f"Error reading file {file_path}: {e}")
         
-        raw_data = df_raw.values.tolist()
-        
         # Find header using sequential pattern detection
-        header_row = self.find_header_with_sequential_pattern(raw_data)
+        header_row = self.find_header_with_sequential_pattern(df_raw)
         if header_row is None:
             raise ValueError(f"Could not detect header row in {filename}")
         
-        # Extract headers
+        headers = self._extract_headers(df_raw.iloc[header_row].tolist())
+        
+        # Process data rows (everything after header)
+        structured_data = self._build_records(df_raw.iloc[header_row + 1:], headers, file_id, filename, header_row)
+        
+        return self._success_result(file_path, file_id, structured_data, headers, header_row)
+    
+    def _extract_headers(self, header_data: List) -> List[str]:
+        """Build column names from the detected header row."""
         headers = []
-        header_data = raw_data[header_row]
         for cell in header_data:
-            if cell is not None and str(cell).strip():
-                headers.append(str(cell).strip())
-            else:
-                headers.append(f"Column_{len(headers)+1}")
+            name = str(cell).strip() if cell is not None else ''
+            headers.append(name or f"Column_{len(headers)+1}")
+        return headers
+    
+    def _build_records(self, data_rows: pd.DataFrame, headers: List[str], file_id: str,
+                       filename: str, header_row: int, start_index: int = 0) -> List[Dict[str, Any]]:
+        """Map raw data rows onto the headers, skipping empty rows."""
+        cells = data_rows.to_numpy(dtype=object)
         
-        # Process data rows (everything after header)
-        data_rows = raw_data[header_row + 1:]
-        structured_data = []
+        # Normalize each cell once: stripped text, '' for missing cells
+        texts = [['' if cell is None else str(cell).strip() for cell in row] for row in cells.tolist()]
+        if not texts:
+            return []
+        filled = np.array(texts, dtype=object) != ''
         
-        for row_idx, row in enumerate(data_rows):
-            # Skip completely empty rows
-            if not any(cell and str(cell).strip() for cell in row):
-                continue
-            
+        # Columns that end up in a record: the last of any duplicate header, minus '_' names
+        value_columns = [col_idx for col_idx in {header: col_idx for col_idx, header in enumerate(headers)}.values()
+                         if not headers[col_idx].startswith('_')]
+        
+        # Skip completely empty rows (falsy cells such as 0 do not count),
+        # and only add records that have some meaningful data
+        keep = (filled & cells.astype(bool)).any(axis=1) & filled[:, value_columns].any(axis=1)
+        
+        structured_data = []
+        for position in np.flatnonzero(keep).tolist():
+            row_idx = start_index + position
             record = {
                 '_file_id': file_id, 
                 '_filename': filename, 
@@ -168,35 +561,120 @@ class ExcelRAGProcessor:
             }
             
             # Map data to headers
-            for col_idx, header in enumerate(headers):
-                if col_idx < len(row):
-                    value = row[col_idx]
-                    # Normalize the value
-                    if value is not None:
-                        record[header] = str(value).strip()
-                    else:
-                        record[header] = ''
-                else:
-                    record[header] = ''
-            
-            # Only add records that have some meaningful data
-            if any(record[key] and str(record[key]).strip() for key in record if not key.startswith('_')):
-                structured_data.append(record)
+            record.update(zip(headers, texts[position]))
+            structured_data.append(record)
         
+        return structured_data
+    
+    def _success_result(self, file_path: str, file_id: str, data: List[Dict[str, Any]],
+                        headers: List[str], header_row: int) -> Dict[str, Any]:
+        """Build the processing result for a successfully parsed file."""
         return {
             'status': 'success',
-            'filename': filename,
+            'filename': os.path.basename(file_path),
             'file_id': file_id,
-            'data': structured_data,
+            'data': data,
             'columns': headers,
             'header_row': header_row,
             'rows_deleted_above_header': header_row,
-            'row_count': len(structured_data),
+            'row_count': len(data),
             'column_count': len(headers)
         }
     
+    def _error_result(self, file_path: str, error: Exception) -> Dict[str, Any]:
+        """Build the processing result for a file that failed to load."""
+        return {
+            'status': 'error',
+            'filename': os.path.basename(file_path),
+            'error': str(error)
+        }
+    
+    def _record_texts(self, records: List[Dict[str, Any]]) -> List[str]:
+        """Serialize records as "Record from <file>:" followed by "column: value" lines."""
+        # Record values are already stripped strings, so truthiness marks non-empty cells
+        return [
+            "\n".join([f"Record from {record['_filename']}:"] +
+                      [f"{key}: {value}" for key, value in record.items() if value and not key.startswith('_')])
+            for record in records
+        ]
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts with one direct model call, returning L2-normalized vectors.
+        SentenceTransformer.encode sorts its inputs by length before batching,
+        so each batch is padded only to similar lengths.
+        """
+        if self.embedding_model == STATIC_EMBEDDING_MODEL:
+            vectors = self.embeddings.encode(texts, show_progress_bar=False)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors / np.maximum(norms, 1e-12)
+        return self.embeddings.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            show_progress_bar=False,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+    
+    def _embed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed record texts, encoding only those not already in the embedding cache.
+        New vectors are written to the cache on a background thread while the next
+        batch is encoded.
+        """
+        if self._embedding_cache is None:
+            return self._encode(texts)
+        
+        keys = [hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts]
+        vectors = self._embedding_cache.get_many(keys, self.embedding_model)
+        missing = [i for i, key in enumerate(keys) if key not in vectors]
+        if missing:
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                writes = []
+                for start in range(0, len(missing), EMBED_WRITE_BATCH):
+                    batch = missing[start:start + EMBED_WRITE_BATCH]
+                    encoded = self._encode([texts[i] for i in batch])
+                    new_items = [(keys[i], vector) for i, vector in zip(batch, encoded)]
+                    vectors.update(new_items)
+                    writes.append(writer.submit(self._embedding_cache.set_many, new_items, self.embedding_model))
+                for write in writes:
+                    write.result()
+        logger.info("Embedded %s texts, %s from cache", len(texts), len(texts) - len(missing))
+        return np.vstack([vectors[key] for key in keys])
+    
+    def _drop_index(self):
+        """Discard the vector index and the texts it points at."""
+        self.vector_store = None
+        self._documents = []
+        self._indexed_rows = set()
+    
     def _build_rag_system(self):
         """Build RAG system from processed data with error handling."""
+        self._drop_index()
+        self._add_documents(self.all_records)
+    
+    @staticmethod
+    def _row_hash(record: Dict[str, Any]) -> bytes:
+        """Hash of a record's column values, independent of the file and row it came from."""
+        content = "\x1f".join(
+            f"{key}\x1e{value}" for key, value in record.items() if value and not key.startswith('_')
+        )
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+    
+    def _document_texts(self) -> List[str]:
+        """Serialized text of every loaded record, extended as records are appended."""
+        if len(self._doc_texts) < len(self.all_records):
+            self._doc_texts.extend(self._record_texts(self.all_records[len(self._doc_texts):]))
+        return self._doc_texts
+    
+    def _add_documents(self, records: List[Dict[str, Any]]):
+        """
+        Embed records and append them to the vector store, creating it on first use.
+        records are the last ones appended to all_records, whose cached texts are reused.
+        """
+        if not records:
+            return
+        
         try:
             # Initialize embeddings lazily
             self._initialize_embeddings()
@@ -205,107 +683,221 @@ class ExcelRAGProcessor:
                 logger.warning("Embeddings not available, using fallback search")
                 return
             
+            # Rows repeated across files (e.g. monthly exports) are embedded only once
+            texts = self._document_texts()
+            start = len(self.all_records) - len(records)
             documents = []
+            for position, record in enumerate(records, start):
+                row_hash = self._row_hash(record)
+                if row_hash not in self._indexed_rows:
+                    self._indexed_rows.add(row_hash)
+                    documents.append(texts[position])
+            if not documents:
+                return
             
-            for record in self.all_records:
-                content_parts = [f"Record from {record['_filename']}:"]
-                
-                for key, value in record.items():
-                    if not key.startswith('_') and value and str(value).strip():
-                        content_parts.append(f"{key}: {value}")
-                
-                content = "\n".join(content_parts)
-                
-                doc = Document(
-                    page_content=content,
-                    metadata={
-                        'filename': record['_filename'], 
-                        'file_id': record['_file_id'],
-                        'row_index': record.get('_row_index', 0)
-                    }
-                )
-                documents.append(doc)
+            embeddings = np.ascontiguousarray(self._embed_documents(documents), dtype=np.float32)
             
-            if documents:
-                self.vector_store = Chroma.from_documents(
-                    documents=documents,
-                    embedding=self.embeddings,
-                    persist_directory="./chroma_db"
-                )
-                logger.info(f"Built RAG system with {len(documents)} documents")
+            if self.vector_store is None:
+                # Vectors are L2-normalized, so inner product ranks by cosine similarity
+                self.vector_store = faiss.IndexFlatIP(embeddings.shape[1])
+            self.vector_store.add(embeddings)
+            self._documents.extend(documents)
+            logger.info("Added %s documents to RAG system", len(documents))
         except Exception as e:
-            logger.error(f"Error building RAG system: {e}")
-            self.vector_store = None
+            logger.error("Error building RAG system: %s", e)
+            self._drop_index()
+    
+    def release_parsed_data(self):
+        """
+        Drop the per-file lists of parsed rows once they have been indexed.
+        The records stay available through all_records and the vector store.
+        """
+        for result in self.processed_files.values():
+            result.pop('data', None)
+        gc.collect()
+    
+    def reset_store(self):
+        """Drop loaded data, its cached parses and the vector index, keeping the embedding model."""
+        self._drop_index()
+        self._forget_parses()
+        self.all_records = []
+        self._doc_texts = []
+        self.processed_files = {}
+        self._chunk_sources = {}
+        self._data_changed()
+        gc.collect()
+    
+    def close(self):
+        """Release loaded data, the vector store and the embedding model."""
+        # Cached parses outlive the processor; only an explicit reset drops them
+        self._parsed_paths = set()
+        self.reset_store()
+        self.embeddings = None
+        self.embedding_model = None
+        if self._embedding_cache is not None and self._owns_caches:
+            self._embedding_cache.close()
+        self._embedding_cache = None
+        if self._parse_cache is not None and self._owns_caches:
+            with self._parse_cache_lock:
+                self._parse_cache.close()
+        self._parse_cache = None
+        gc.collect()
+    
+    def embed_query(self, text: str) -> Optional[np.ndarray]:
+        """Embed a query with the RAG embedding model, or return None if unavailable."""
+        self._initialize_embeddings()
+        if self.embeddings is None:
+            return None
+        try:
+            return np.asarray(self._encode([text])[0], dtype=np.float32)
+        except Exception as e:
+            logger.error("Error embedding query: %s", e)
+            return None
+    
+    def _data_changed(self):
+        """Forget everything derived from all_records; each piece is rebuilt on next use."""
+        self._data_signature = None
+        self.records_df = None
+        self._records_str = None
+        self._records_lower = None
+        self._id_index = None
+        self._inverted = None
+    
+    def data_signature(self) -> str:
+        """Content hash of the loaded records, used to key cached query answers."""
+        if self._data_signature is None:
+            payload = json.dumps(self.all_records, ensure_ascii=False, default=str)
+            self._data_signature = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+        return self._data_signature
     
     def find_exact_record(self, search_id: str, search_name: str = None) -> Dict[str, Any]:
         """Find exact record by ID and optionally name."""
-        logger.info(f"Searching for ID: {search_id}, Name: {search_name}")
+        logger.info("Searching for ID: %s, Name: %s", search_id, search_name)
         
-        for record in self.all_records:
-            # Check all fields for the ID
-            id_found = False
-            name_found = search_name is None  # If no name specified, consider it found
-            
-            for key, value in record.items():
-                if key.startswith('_'):
-                    continue
-                    
-                value_str = str(value).strip()
-                
-                # Check for ID match
-                if search_id in value_str:
-                    id_found = True
-                
-                # Check for name match if provided
-                if search_name and search_name.lower() in value_str.lower():
-                    name_found = True
-            
-            # If both ID and name found (or name not required), return this record
-            if id_found and name_found:
-                logger.info(f"Found matching record in {record['_filename']}")
+        # Records holding the ID as a whole cell value are checked first
+        for position in self._id_lookup().get(search_id, ()):
+            record = self.all_records[position]
+            if search_name is None or (search_name and any(
+                    search_name.lower() in value.lower()
+                    for key, value in record.items() if not key.startswith('_'))):
+                logger.info("Found matching record in %s", record['_filename'])
                 return record
         
-        logger.info(f"No record found for ID: {search_id}")
+        # Otherwise scan for the ID anywhere inside the values
+        row_text, row_text_lower = self._record_frames()
+        
+        # Check all fields for the ID
+        match = row_text.str.contains(search_id, regex=False)
+        
+        # Check for name match if provided
+        if search_name is not None:
+            if search_name:
+                match &= row_text_lower.str.contains(search_name.lower(), regex=False)
+            else:
+                match &= False
+        
+        # Return the first record where both ID and name were found (or name not required)
+        if match.any():
+            record = self.all_records[int(np.argmax(match.to_numpy()))]
+            logger.info("Found matching record in %s", record['_filename'])
+            return record
+        
+        logger.info("No record found for ID: %s", search_id)
         return None
     
+    def _records_frame(self) -> pd.DataFrame:
+        """all_records as a DataFrame, rebuilt after the data changes."""
+        if self.records_df is None:
+            self.records_df = pd.DataFrame(self.all_records)
+        return self.records_df
+    
+    def _value_columns(self) -> pd.DataFrame:
+        """Record values without the internal '_' fields; missing columns are empty strings."""
+        records_df = self._records_frame()
+        value_columns = [column for column in records_df.columns if not column.startswith('_')]
+        return records_df[value_columns].fillna('').astype(str)
+    
+    def _id_lookup(self) -> Dict[str, List[int]]:
+        """
+        Index of record IDs to the positions of the records holding them. IDs come
+        from columns whose filled cells are all IDs and from "ID - Name" cells.
+        """
+        if self._id_index is None:
+            positions = defaultdict(set)
+            for _, column in self._value_columns().items():
+                filled = column[column != '']
+                if filled.empty:
+                    continue
+                if filled.str.fullmatch(ID_VALUE_RE).all():
+                    ids = filled
+                else:
+                    ids = filled.str.extract(ID_NAME_RE, expand=False).dropna()
+                for position, value in zip(ids.index, ids):
+                    positions[value].add(position)
+            self._id_index = {value: sorted(rows) for value, rows in positions.items()}
+        return self._id_index
+    
+    def _record_frames(self):
+        """
+        Each record's values joined into one string, as-is and lowercased.
+        Built from records_df and rebuilt only after the data changes.
+        """
+        if self._records_str is None:
+            values = self._value_columns()
+            if len(values.columns):
+                # The separator keeps a match from spanning two fields
+                row_text = values.iloc[:, 0].str.cat(values.iloc[:, 1:], sep='\x1f')
+            else:
+                row_text = pd.Series('', index=values.index)
+            self._records_str = row_text
+            self._records_lower = row_text.str.lower()
+        return self._records_str, self._records_lower
+    
     def _simple_text_search(self, question: str, k: int = 3) -> List[str]:
         """Fallback text search when vector search is not available."""
-        question_lower = question.lower()
-        results = []
+        inverted = self._text_index()
         
-        for record in self.all_records:
-            content_parts = [f"Record from {record['_filename']}:"]
-            match_score = 0
-            
-            for key, value in record.items():
-                if not key.startswith('_') and value and str(value).strip():
-                    value_str = str(value).strip()
-                    content_parts.append(f"{key}: {value_str}")
-                    
-                    # Simple keyword matching
-                    if any(word in value_str.lower() for word in question_lower.split()):
-                        match_score += 1
-            
-            if match_score > 0:
-                results.append((match_score, "\n".join(content_parts)))
+        # Score each record by the fields that contain a question word
+        scores = Counter()
+        for token in set(TOKEN_RE.findall(question.lower())):
+            for position, field_count in inverted.get(token, ()):
+                scores[position] += field_count
         
-        # Sort by match score and return top k
-        results.sort(key=lambda x: x[0], reverse=True)
-        return [content for _, content in results[:k]]
+        # Top k by score; ties go to the record loaded first
+        top = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        texts = self._document_texts()
+        return [texts[position] for position, _ in top]
+    
+    def _text_index(self) -> Dict[str, List[Tuple[int, int]]]:
+        """Inverted index of value tokens to (record position, number of fields containing the token)."""
+        if self._inverted is None:
+            inverted = defaultdict(list)
+            for position, record in enumerate(self.all_records):
+                field_counts = Counter()
+                for key, value in record.items():
+                    if value and not key.startswith('_'):
+                        field_counts.update(set(TOKEN_RE.findall(value.lower())))
+                for token, field_count in field_counts.items():
+                    inverted[token].append((position, field_count))
+            self._inverted = dict(inverted)
+        return self._inverted
     
-    def query(self, question: str) -> str:
-        """Answer user queries with systematic search."""
+    def query(self, question: str, query_embedding: Optional[np.ndarray] = None) -> str:
+        """
+        Answer user queries with systematic search.
+        query_embedding, if the caller already has it from embed_query(), saves encoding the question again.
+        """
         if not self.all_records:
             return "No data available. Please process files first."
         
         # Extract ID and name from question
-        id_match = re.search(r'\b(\d{4,6})\b', question)
+        id_match = QUERY_ID_RE.search(question)
         
         if id_match:
             search_id = id_match.group(1)
             
             # Extract name (everything after the ID and dash)
-            name_match = re.search(rf'{search_id}\s*-\s*([^?]+)', question)
+            name_match = _name_pattern(search_id).search(question)
             search_name = name_match.group(1).strip() if name_match else None
             
             # Find the exact record
@@ -313,29 +905,12 @@ class ExcelRAGProcessor:
             
             if record:
                 # Extract what information is being asked for
-                question_lower = question.lower()
-                
-                # Map common questions to column names
-                field_mappings = {
-                    'ac no': ['Ac No', 'Account No', 'Account Number'],
-                    'organization': ['Organization', 'Org', 'Company'],
-                    'designation': ['Designation', 'Position', 'Title'],
-                    'job duration': ['Job Duration', 'Duration', 'Service'],
-                    'total business': ['Total Business', 'Total Premium', 'Business'],
-                    'commission': ['Commission', 'Com'],
-                    'pf': ['PF', 'Provident Fund'],
-                    'allowance': ['Allowance', 'Allow'],
-                    'net pay': ['Net Pay', 'Net', 'Pay'],
-                    'tds': ['TDS', 'Tax'],
-                    'total premium': ['Total Premium', 'Premium', 'Total PR'],
-                    'agent name': ['Agent Name', 'Name'],
-                    'sl': ['Sl', 'Serial', 'ID']
-                }
+                asked_phrases = set(FIELD_PHRASE_RE.findall(question.lower()))
                 
                 # Find what field is being asked about
                 requested_field = None
-                for key_phrase, possible_columns in field_mappings.items():
-                    if key_phrase in question_lower:
+                for key_phrase, possible_columns in FIELD_MAPPINGS.items():
+                    if key_phrase in asked_phrases:
                         # Look for matching column in the record
                         for col_name in possible_columns:
                             if col_name in record:
@@ -360,8 +935,9 @@ class ExcelRAGProcessor:
                         answer += f" - {search_name}"
                     answer += f":\n\n"
                     
+                    # Record values are already stripped strings
                     for key, value in record.items():
-                        if not key.startswith('_') and value and str(value).strip():
+                        if value and not key.startswith('_'):
                             answer += f"• {key}: {value}\n"
                     
                     answer += f"\n(Source: {record['_filename']})"
@@ -374,16 +950,21 @@ class ExcelRAGProcessor:
                 return f"No record found for ID {search_id}" + (f" with name {search_name}" if search_name else "") + " in the loaded data."
         
         # If no ID pattern found, use vector search or fallback
-        if self.vector_store:
+        if self.vector_store is not None:
             try:
-                relevant_docs = self.vector_store.similarity_search(question, k=3)
+                if query_embedding is None:
+                    query_embedding = self._encode([question])
+                query_vector = np.ascontiguousarray(np.reshape(query_embedding, (1, -1)), dtype=np.float32)
+                _, positions = self.vector_store.search(query_vector, VECTOR_SEARCH_K)
+                # FAISS pads with -1 when the index holds fewer than k vectors
+                relevant_docs = [self._documents[i] for i in positions[0] if i >= 0]
                 if relevant_docs:
-                    context = "\n\n".join([doc.page_content for doc in relevant_docs])
+                    context = "\n\n".join(relevant_docs)
                     return f"Based on the data, here's what I found:\n\n{context}"
                 else:
                     return "No relevant information found for your query."
             except Exception as e:
-                logger.error(f"Vector search error: {e}")
+                logger.error("Vector search error: %s", e)
                 # Fall back to simple text search
                 results = self._simple_text_search(question)
                 if results:
@@ -398,6 +979,58 @@ class ExcelRAGProcessor:
             else:
                 return "No relevant information found for your query."
     
+    def answer_metadata_query(self, question: str) -> Optional[str]:
+        """
+        Answer questions about the loaded files, columns and row counts directly.
+        Returns None when the question is not a metadata question.
+        """
+        if not self.processed_files or QUERY_ID_RE.search(question):
+            return None
+        
+        # Whole-question match only: "how many rows have Designation BM?" is a data question
+        match = METADATA_QUERY_RE.fullmatch(question.strip())
+        if not match:
+            return None
+        if match.group('files'):
+            return self.list_files()
+        if match.group('columns'):
+            return self.list_columns()
+        return self.count_rows()
+    
+    def list_files(self) -> str:
+        """Describe the loaded files."""
+        lines = [f"📄 {len(self.processed_files)} file(s) loaded:"]
+        for result in self.processed_files.values():
+            if result['status'] == 'success':
+                lines.append(f"• {result['filename']} ({result['row_count']} rows, {result['column_count']} columns)")
+            else:
+                lines.append(f"• {result['filename']} (failed: {result.get('error', 'Unknown error')})")
+        return "\n".join(lines)
+    
+    def list_columns(self) -> str:
+        """List the columns of each loaded file."""
+        lines = []
+        for result in self.processed_files.values():
+            if result['status'] == 'success':
+                columns = list(dict.fromkeys(result['columns']))
+                lines.append(f"📋 {result['filename']}: {', '.join(columns)}")
+        return "\n".join(lines) or "No columns found in the loaded data."
+    
+    def count_rows(self) -> str:
+        """Report the number of data rows per file and in total."""
+        lines = [f"📊 {len(self.all_records)} rows loaded in total:"]
+        for result in self.processed_files.values():
+            if result['status'] == 'success':
+                lines.append(f"• {result['filename']}: {result['row_count']} rows")
+        return "\n".join(lines)
+    
+    def query_stream(self, question: str, query_embedding: Optional[np.ndarray] = None) -> Iterator[str]:
+        """
+        Yield the answer to a question in pieces, so callers can render it progressively.
+        Answers are built locally, so the pieces are the lines of the query() answer.
+        """
+        yield from self.query(question, query_embedding).splitlines(keepends=True)
+    
     def get_all_data_summary(self) -> str:
         """Get a summary of all loaded records."""
         if not self.all_records:
@@ -405,32 +1038,39 @@ class ExcelRAGProcessor:
         
         summary = f"📊 **Total Records Loaded: {len(self.all_records)}**\n\n"
         
-        # Group by file
-        file_groups = {}
+        # Count records per file, in load order, without bucketing every record
+        record_counts = Counter(map(itemgetter('_filename'), self.all_records))
+        
+        # Only the first few records of each file are inspected; stop once every file has them
+        first_records = defaultdict(list)
+        files_left = len(record_counts)
         for record in self.all_records:
-            filename = record['_filename']
-            if filename not in file_groups:
-                file_groups[filename] = []
-            file_groups[filename].append(record)
+            records = first_records[record['_filename']]
+            if len(records) < 5:
+                records.append(record)
+                if len(records) == 5:
+                    files_left -= 1
+                    if not files_left:
+                        break
         
-        for filename, records in file_groups.items():
-            summary += f"**File: {filename}** ({len(records)} records)\n"
+        for filename, record_count in record_counts.items():
+            records = first_records[filename]
+            summary += f"**File: {filename}** ({record_count} records)\n"
             
             # Show column names
-            if records:
-                columns = [key for key in records[0].keys() if not key.startswith('_')]
-                summary += f"Columns: {', '.join(columns)}\n"
-                
-                # Show first few IDs
-                sample_ids = []
-                for record in records[:5]:
-                    for key, value in record.items():
-                        if not key.startswith('_') and value and str(value).strip().isdigit() and len(str(value).strip()) >= 4:
-                            sample_ids.append(str(value).strip())
-                            break
-                
-                if sample_ids:
-                    summary += f"Sample IDs: {', '.join(sample_ids)}\n"
+            columns = [key for key in records[0].keys() if not key.startswith('_')]
+            summary += f"Columns: {', '.join(columns)}\n"
+            
+            # Show first few IDs (record values are already stripped strings)
+            sample_ids = []
+            for record in records:
+                for key, value in record.items():
+                    if not key.startswith('_') and value.isdigit() and len(value) >= 4:
+                        sample_ids.append(value)
+                        break
+            
+            if sample_ids:
+                summary += f"Sample IDs: {', '.join(sample_ids)}\n"
             
             summary += "\n"
         
@@ -0,0 +1,97 @@
+# query_cache.py - Persistent cache of query responses
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class QueryCache:
+    """
+    Two-tier cache of query responses persisted in SQLite.
+    Exact hits are keyed by the normalized question; semantic hits compare the
+    question embedding against previously answered questions.
+    """
+    
+    def __init__(self, path: str = ".ragcache/queries.db", ttl: int = 3600,
+                 similarity_threshold: float = 0.95):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, namespace TEXT, numbers TEXT, "
+            "embedding BLOB, response TEXT, expires REAL)"
+        )
+        self._conn.commit()
+    
+    @staticmethod
+    def _normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+    
+    @staticmethod
+    def _numbers(query: str) -> str:
+        # IDs and amounts must match exactly: "ID 157408" and "ID 157409" embed almost identically
+        return " ".join(re.findall(r"\d+", query))
+    
+    def _key(self, query: str, namespace: str) -> str:
+        text = f"{namespace}\0{self._normalize(query)}"
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def get(self, query: str, namespace: str) -> Optional[str]:
+        """Return the cached response for exactly this question, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires > ?",
+                (self._key(query, namespace), time.time())
+            ).fetchone()
+        return row[0] if row else None
+    
+    def get_similar(self, query: str, namespace: str, embedding: np.ndarray) -> Optional[str]:
+        """Return the response of the most similar cached question above the threshold."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT embedding, response FROM responses "
+                "WHERE namespace = ? AND numbers = ? AND expires > ? AND embedding IS NOT NULL",
+                (namespace, self._numbers(query), time.time())
+            ).fetchall()
+        # Vectors from another embedding model cannot be compared with this one
+        candidates = [(np.frombuffer(blob, dtype=np.float32), response) for blob, response in rows]
+        candidates = [(vector, response) for vector, response in candidates if vector.size == embedding.size]
+        if not candidates:
+            return None
+        
+        matrix = np.vstack([vector for vector, _ in candidates])
+        scores = matrix @ embedding.astype(np.float32)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            logger.info("Semantic cache hit (similarity %.3f)", scores[best])
+            return candidates[best][1]
+        return None
+    
+    def set(self, query: str, namespace: str, response: str,
+            embedding: Optional[np.ndarray] = None) -> None:
+        """Store a response, with the question embedding for semantic lookups."""
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(query, namespace), namespace, self._numbers(query),
+                 blob, response, time.time() + self.ttl)
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
@@ -1,4 +1,4 @@
 # filepath: d:\Alim\Code\chatbot_new\test_import.py
-from langchain_community.vectorstores import Chroma
+import faiss
 
 print("Import successful!")
\ No newline at end of file